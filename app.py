@@ -2,8 +2,10 @@ from datetime import date
 from io import BytesIO
 
 import gspread
+import numpy as np
 import pandas as pd
 import streamlit as st
+import xlsxwriter
 from google.oauth2.service_account import Credentials
 from gspread.exceptions import SpreadsheetNotFound, APIError
 
@@ -34,6 +36,8 @@ COLUMNS = [
     "总收入",
 ]
 
+NUMERIC_COLUMNS = ["ID", "服务时长(分钟)", "工时(小时)", "服务收入", "小费", "总收入"]
+
 STAFF_COLUMNS = ["员工姓名"]
 DURATION_OPTIONS = [30, 45, 60, 75, 90, 105, 120]
 
@@ -56,11 +60,11 @@ def get_gsheet_client():
     return gspread.authorize(creds)
 
 
-def get_or_create_worksheet(title: str):
-    """打开指定工作表，不存在就创建并写表头"""
+@st.cache_resource(show_spinner=False)
+def open_spreadsheet():
+    """打开/创建整个 Spreadsheet（句柄缓存，避免每次操作都查一遍 Drive）"""
     client = get_gsheet_client()
 
-    # 先打开/创建整个 Spreadsheet
     try:
         sh = client.open(SPREADSHEET_NAME)
     except SpreadsheetNotFound:
@@ -74,8 +78,14 @@ def get_or_create_worksheet(title: str):
     except APIError as e:
         st.error(f"打开 Google Sheet 出错：{e}")
         st.stop()
+    return sh
+
+
+@st.cache_resource(show_spinner=False)
+def get_or_create_worksheet(title: str):
+    """打开指定工作表，不存在就创建并写表头（句柄按标题缓存）"""
+    sh = open_spreadsheet()
 
-    # 再打开/创建单个 sheet
     try:
         ws = sh.worksheet(title)
     except gspread.WorksheetNotFound:
@@ -89,13 +99,18 @@ def get_or_create_worksheet(title: str):
 
 # ------------ 读写工时记录 ------------
 
-@st.cache_data(ttl=30)
+@st.cache_resource(ttl=300, show_spinner=False)
 def load_records() -> pd.DataFrame:
-    """从 Google Sheets 读取工时记录（带缓存，减少配额压力）"""
+    """从 Google Sheets 读取工时记录（带缓存，减少配额压力）
+
+    用 cache_resource 而不是 cache_data：返回的是同一个 DataFrame 对象，
+    每次 rerun 不再整表深拷贝。调用方要改数据必须先 .copy()。
+    """
     ws = get_or_create_worksheet(SHEET_RECORD)
 
     try:
-        records = ws.get_all_records()
+        # get_all_values 直接返回二维列表，省掉 get_all_records 逐行建 dict 的开销
+        vals = ws.get_all_values()
     except APIError as e:
         # 如果是配额问题，给出更友好的提示
         if "Quota exceeded for quota metric 'Read requests'" in str(e):
@@ -107,57 +122,86 @@ def load_records() -> pd.DataFrame:
         else:
             raise
 
-    df = pd.DataFrame(records)
-
-    if df.empty:
+    if len(vals) > 1:
+        df = pd.DataFrame(vals[1:], columns=vals[0])
+    else:
         df = pd.DataFrame(columns=COLUMNS)
 
     # 确保所有列存在
     for col in COLUMNS:
         if col not in df.columns:
-            if col in ["服务时长(分钟)", "工时(小时)", "服务收入", "小费", "总收入", "ID"]:
-                df[col] = 0
-            else:
-                df[col] = ""
-
-    # ID 处理
-    df["ID"] = pd.to_numeric(df["ID"], errors="coerce")
-    if df["ID"].isna().all():
-        df["ID"] = range(1, len(df) + 1)
-    else:
-        max_id = int(df["ID"].max()) if not df["ID"].isna().all() else 0
-        for idx, val in df["ID"].items():
-            if pd.isna(val):
-                max_id += 1
-                df.at[idx, "ID"] = max_id
+            df[col] = 0 if col in NUMERIC_COLUMNS else ""
+
+    # 数值列统一向量化转换（原始值都是字符串）
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+        if col != "ID":
+            df[col] = df[col].fillna(0)
+
+    # ID 处理（缺失的 ID 一次性向量化补齐，不做逐行循环）
+    nan_mask = df["ID"].isna().to_numpy()
+    if nan_mask.any():
+        max_id = 0 if nan_mask.all() else int(df["ID"].max())
+        df.loc[nan_mask, "ID"] = np.arange(
+            max_id + 1, max_id + 1 + int(nan_mask.sum())
+        )
 
     df["ID"] = df["ID"].astype(int)
 
-    return df[COLUMNS]
+    # 日期只在这里解析一次，后续筛选/导出直接用 _date 列做 datetime64 比较
+    df["_date"] = pd.to_datetime(df["日期"], errors="coerce")
+
+    # 年月提前算成整数 yyyymm：月度 groupby 用整数键，展示时才格式化成 "YYYY-MM"
+    df["_ym"] = df["_date"].dt.year * 100 + df["_date"].dt.month
+
+    # 低基数字符串列转 category，groupby/isin 走整数 codes 而不是逐行比较字符串
+    df["员工姓名"] = df["员工姓名"].astype("category")
+    df["服务项目"] = df["服务项目"].astype("category")
+
+    return df[COLUMNS + ["_date", "_ym"]]
 
 
 def save_all(records_df: pd.DataFrame):
     """把工时记录写回 Google Sheets 的“工时记录”工作表"""
     ws = get_or_create_worksheet(SHEET_RECORD)
-    ws.clear()
-    ws.append_row(COLUMNS)
+    body = [COLUMNS]
     if not records_df.empty:
-        rows = records_df[COLUMNS].astype(object).values.tolist()
-        ws.append_rows(rows)
+        # 逐列 .tolist() 直接得到原生 Python 标量（JSON 可序列化），
+        # 不走 astype(object) 的整表对象数组复制
+        body += [
+            list(row)
+            for row in zip(*(records_df[col].tolist() for col in COLUMNS))
+        ]
+
+    # 先 clear 再一次性写入表头+数据（1 次 update 代替 表头/数据 2 次 append）
+    ws.clear()
+    ws.update(body, "A1", value_input_option="RAW")
 
     # 写入后清除缓存，下次读取会重新请求 Google Sheets
     load_records.clear()
 
 
+def append_record(record: dict):
+    """只追加一条记录（单次 append API 调用，不用整表重写）"""
+    ws = get_or_create_worksheet(SHEET_RECORD)
+    ws.append_row(
+        [record[col] for col in COLUMNS],
+        value_input_option="USER_ENTERED",
+    )
+
+    # 写入后清除缓存
+    load_records.clear()
+
+
 # ------------ 读写员工表 ------------
 
-@st.cache_data(ttl=30)
+@st.cache_resource(ttl=300, show_spinner=False)
 def load_staff() -> pd.DataFrame:
-    """从 Google Sheets 读取员工列表（带缓存）"""
+    """从 Google Sheets 读取员工列表（带缓存，返回共享对象，勿原地修改）"""
     ws = get_or_create_worksheet(SHEET_STAFF)
 
     try:
-        rows = ws.get_all_records()
+        vals = ws.get_all_values()
     except APIError as e:
         if "Quota exceeded for quota metric 'Read requests'" in str(e):
             st.error(
@@ -168,9 +212,9 @@ def load_staff() -> pd.DataFrame:
         else:
             raise
 
-    df = pd.DataFrame(rows)
-
-    if df.empty:
+    if len(vals) > 1:
+        df = pd.DataFrame(vals[1:], columns=vals[0])
+    else:
         df = pd.DataFrame(columns=STAFF_COLUMNS)
 
     if "员工姓名" not in df.columns:
@@ -182,23 +226,65 @@ def load_staff() -> pd.DataFrame:
 def save_staff(df: pd.DataFrame):
     """把员工列表写回 Google Sheets 的“员工表”工作表"""
     ws = get_or_create_worksheet(SHEET_STAFF)
-    ws.clear()
-    ws.append_row(STAFF_COLUMNS)
+    body = [STAFF_COLUMNS]
     if not df.empty:
-        ws.append_rows(df[STAFF_COLUMNS].astype(object).values.tolist())
+        body += [
+            list(row)
+            for row in zip(*(df[col].tolist() for col in STAFF_COLUMNS))
+        ]
 
-    # 写入后清除缓存
+    ws.clear()
+    ws.update(body, "A1", value_input_option="RAW")
+
+    # 写入后清除缓存（包括派生的姓名列表和 session 里的姓名集合）
     load_staff.clear()
+    get_staff_list.clear()
+    st.session_state.pop("_staff_set", None)
+
+
+def distinct_names(series: pd.Series) -> list:
+    """去重、去空白项并排序的姓名列表（各页面下拉选项共用）"""
+    return sorted(x for x in series.dropna().unique().tolist() if str(x).strip())
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def get_staff_list() -> list:
+    """员工表里的姓名列表（缓存，免得每次 rerun 都重新去重排序）
+
+    ttl 与 load_staff 保持一致：直接在表里改动的员工最迟 5 分钟后出现。
+    """
+    return distinct_names(load_staff()["员工姓名"])
+
+
+def staff_name_set() -> set:
+    """员工姓名集合（放在 session_state 里，O(1) 判断是否存在）"""
+    if "_staff_set" not in st.session_state:
+        st.session_state["_staff_set"] = set(
+            load_staff()["员工姓名"].astype(str).tolist()
+        )
+    return st.session_state["_staff_set"]
 
 
 def ensure_staff_exists(name: str):
-    """如果员工不在员工表里，就自动加入。"""
+    """如果员工不在员工表里，就自动加入（已存在时不发任何请求）。"""
     if not name:
         return
-    df = load_staff()
-    if name not in df["员工姓名"].astype(str).tolist():
-        df = pd.concat([df, pd.DataFrame([{"员工姓名": name}])], ignore_index=True)
-        save_staff(df)
+    staff_set = staff_name_set()
+    if name in staff_set:
+        return
+
+    # 只追加一行，不做整表重写
+    ws = get_or_create_worksheet(SHEET_STAFF)
+    ws.append_row([name], value_input_option="RAW")
+    staff_set.add(name)
+    load_staff.clear()
+    get_staff_list.clear()
+
+
+def ym_label(ym) -> str:
+    """整数年月（yyyymm）转成展示用的 \"YYYY-MM\"。"""
+    ym = int(ym)
+    return f"{ym // 100}-{ym % 100:02d}"
 
 
 def make_summary(df: pd.DataFrame) -> pd.DataFrame:
@@ -207,11 +293,11 @@ def make_summary(df: pd.DataFrame) -> pd.DataFrame:
         return pd.DataFrame(
             columns=["日期", "员工姓名", "工时(小时)", "服务收入", "小费", "总收入"]
         )
-    return (
-        df.groupby(["日期", "员工姓名"])[["工时(小时)", "服务收入", "小费", "总收入"]]
-        .sum()
-        .reset_index()
-    )
+    # observed=True：员工姓名是 category，不展开未出现的组合；
+    # sort=False 省一次分组键排序，as_index=False 省 reset_index 的复制
+    return df.groupby(
+        ["日期", "员工姓名"], observed=True, sort=False, as_index=False
+    )[["工时(小时)", "服务收入", "小费", "总收入"]].sum(numeric_only=True)
 
 
 # ------------ 导出相关（导出为 Excel） ------------
@@ -226,46 +312,56 @@ def to_excel_bytes(detail_df: pd.DataFrame, summary_df: pd.DataFrame) -> bytes:
     return output.read()
 
 
+def write_sheet(wb: xlsxwriter.Workbook, title: str, df: pd.DataFrame):
+    """流式写入一张表（表头 + 逐行），返回 (worksheet, 下一可写行号)"""
+    ws = wb.add_worksheet(title)
+    ws.write_row(0, 0, list(df.columns))
+    row_i = 1
+    for row in zip(*(df[col].tolist() for col in df.columns)):
+        ws.write_row(row_i, 0, row)
+        row_i += 1
+    return ws, row_i
+
+
 def to_excel_all_bytes() -> bytes:
     """导出：全部数据 + 每个月一个表，并附上每月总收入（含小费）"""
     records_df = load_records()
     staff_df = load_staff()
 
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
-        summary_df = make_summary(records_df)
-        records_df.to_excel(writer, sheet_name="工时记录_全部", index=False)
-        summary_df.to_excel(writer, sheet_name="汇总_全部", index=False)
-        staff_df.to_excel(writer, sheet_name="员工表", index=False)
+    # constant_memory 模式按行流式写出，内存占用不随行数增长
+    wb = xlsxwriter.Workbook(output, {"constant_memory": True})
+    write_sheet(wb, "工时记录_全部", records_df[COLUMNS])
+    write_sheet(wb, "汇总_全部", make_summary(records_df))
+    write_sheet(wb, "员工表", staff_df)
 
-        if not records_df.empty:
-            date_series = pd.to_datetime(records_df["日期"], errors="coerce")
-            tmp = records_df.copy()
-            tmp["_ym"] = date_series.dt.strftime("%Y-%m")
-
-            monthly_summary = (
-                tmp.groupby("_ym")[["服务收入", "小费", "总收入"]]
-                .sum()
-                .reset_index()
-                .rename(columns={"_ym": "月份"})
-            )
-            monthly_summary.to_excel(writer, sheet_name="月度汇总", index=False)
-
-            for ym in sorted(tmp["_ym"].dropna().unique()):
-                month_df = tmp[tmp["_ym"] == ym].drop(columns=["_ym"])
-                totals = month_df[["服务收入", "小费", "总收入"]].sum()
-                total_row = {col: "" for col in month_df.columns}
-                total_row["日期"] = "合计"
-                total_row["服务收入"] = totals["服务收入"]
-                total_row["小费"] = totals["小费"]
-                total_row["总收入"] = totals["总收入"]
-
-                month_df_with_total = pd.concat(
-                    [month_df, pd.DataFrame([total_row])],
-                    ignore_index=True,
-                )
-                month_df_with_total.to_excel(writer, sheet_name=ym, index=False)
+    if not records_df.empty:
+        tmp = records_df[COLUMNS].copy()
+        tmp["_ym"] = records_df["_ym"]
+
+        # 月度合计只聚合一遍：月度汇总表和各月份表尾的合计行共用
+        monthly_totals = tmp.groupby("_ym")[["服务收入", "小费", "总收入"]].sum()
 
+        monthly_summary = monthly_totals.reset_index()
+        monthly_summary["月份"] = monthly_summary["_ym"].map(ym_label)
+        monthly_summary = monthly_summary[["月份", "服务收入", "小费", "总收入"]]
+        write_sheet(wb, "月度汇总", monthly_summary)
+
+        # groupby 一次分好所有月份，省掉每个月一遍布尔掩码扫全表
+        for ym, month_df in tmp.groupby("_ym", sort=True):
+            month_df = month_df.drop(columns=["_ym"])
+            totals = monthly_totals.loc[ym]
+
+            ws, row_i = write_sheet(wb, ym_label(ym), month_df)
+
+            total_row = {col: "" for col in COLUMNS}
+            total_row["日期"] = "合计"
+            total_row["服务收入"] = totals["服务收入"]
+            total_row["小费"] = totals["小费"]
+            total_row["总收入"] = totals["总收入"]
+            ws.write_row(row_i, 0, [total_row[col] for col in COLUMNS])
+
+    wb.close()
     output.seek(0)
     return output.read()
 
@@ -281,12 +377,8 @@ def page_add_record():
         st.session_state["just_saved_msg"] = ""
 
     records_df = load_records()
-    staff_df = load_staff()
 
-    staff_list = sorted(
-        [x for x in staff_df["员工姓名"].dropna().unique().tolist() if str(x).strip()]
-    )
-    staff_list_display = ["（手动输入新员工）"] + staff_list
+    staff_list_display = ["（手动输入新员工）"] + get_staff_list()
 
     date_value = st.date_input("日期", value=date.today())
     staff_choice = st.selectbox("员工姓名（可选择或新填）", staff_list_display)
@@ -344,11 +436,8 @@ def page_add_record():
             "总收入": total_income,
         }
 
-        records_df = pd.concat(
-            [records_df, pd.DataFrame([record])], ignore_index=True
-        )
         ensure_staff_exists(staff_name)
-        save_all(records_df)
+        append_record(record)
 
         st.session_state["just_saved_msg"] = (
             f"✅ 已保存：ID {new_id} | {staff_name} | {duration}分钟 | "
@@ -367,29 +456,30 @@ def page_summary():
         st.info("目前还没有任何记录。")
         return
 
-    all_staff = sorted(
-        [x for x in df_all["员工姓名"].dropna().unique().tolist() if str(x).strip()]
-    )
-    staff_filter = st.multiselect("筛选员工（可多选）", all_staff, default=all_staff)
+    all_staff = distinct_names(df_all["员工姓名"])
 
-    date_series = pd.to_datetime(df_all["日期"], errors="coerce")
+    # 复用加载时解析好的 _date，不再重新 to_datetime
+    date_series = df_all["_date"]
     if date_series.isna().all():
         st.error("所有日期都无效，请检查表格中的“日期”格式。")
         return
 
     min_date, max_date = date_series.min().date(), date_series.max().date()
-    date_range = st.date_input("日期范围", value=(min_date, max_date))
 
-    df_filtered = df_all.copy()
-    if staff_filter:
-        df_filtered = df_filtered[df_filtered["员工姓名"].isin(staff_filter)]
+    # 筛选控件放进 form：调整过程中不触发整页重算，点“应用筛选”才刷新
+    with st.form("summary_filter"):
+        staff_filter = st.multiselect("筛选员工（可多选）", all_staff, default=all_staff)
+        date_range = st.date_input("日期范围", value=(min_date, max_date))
+        st.form_submit_button("应用筛选")
 
+    # 员工 + 日期条件合成一个掩码，只切一次
+    mask = pd.Series(True, index=df_all.index)
+    if staff_filter:
+        mask &= df_all["员工姓名"].isin(staff_filter)
     if isinstance(date_range, tuple) and len(date_range) == 2:
         start_d, end_d = date_range
-        df_filtered = df_filtered[
-            (pd.to_datetime(df_filtered["日期"]) >= pd.to_datetime(start_d))
-            & (pd.to_datetime(df_filtered["日期"]) <= pd.to_datetime(end_d))
-        ]
+        mask &= date_series.between(pd.Timestamp(start_d), pd.Timestamp(end_d))
+    df_filtered = df_all[mask]
 
     if df_filtered.empty:
         st.warning("当前条件下没有数据。")
@@ -401,28 +491,32 @@ def page_summary():
     st.dataframe(summary_filtered, use_container_width=True)
 
     st.markdown("### 💰 月度收入统计（含小费）")
-    df_filtered["_月份"] = pd.to_datetime(
-        df_filtered["日期"], errors="coerce"
-    ).dt.strftime("%Y-%m")
     monthly_summary = (
-        df_filtered.groupby("_月份")[["服务收入", "小费", "总收入"]]
+        df_filtered.groupby("_ym")[["服务收入", "小费", "总收入"]]
         .sum()
         .reset_index()
-        .rename(columns={"_月份": "月份"})
     )
+    monthly_summary["月份"] = monthly_summary["_ym"].map(ym_label)
+    monthly_summary = monthly_summary[["月份", "服务收入", "小费", "总收入"]]
     if not monthly_summary.empty:
         st.dataframe(monthly_summary, use_container_width=True)
     else:
         st.info("当前筛选条件下没有月度数据。")
 
     st.subheader("明细表（当前筛选）")
-    st.dataframe(df_filtered, use_container_width=True)
+    # Arrow 序列化成本随行数线性增长，大表默认只渲染前 500 条
+    detail_view = df_filtered[COLUMNS]
+    if len(detail_view) > 500 and not st.checkbox(
+        f"显示全部 {len(detail_view)} 条（默认只渲染前 500 条）"
+    ):
+        detail_view = detail_view.head(500)
+    st.dataframe(detail_view, use_container_width=True)
 
     col_dl1, col_dl2 = st.columns(2)
     with col_dl1:
         st.download_button(
             label="📥 下载当前筛选结果（选定员工）",
-            data=to_excel_bytes(df_filtered, summary_filtered),
+            data=to_excel_bytes(df_filtered[COLUMNS], summary_filtered),
             file_name="work_log_当前筛选.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
@@ -451,9 +545,7 @@ def page_summary():
         key=f"edit_date_{edit_id}",
     )
 
-    staff_all = sorted(
-        [x for x in df_all["员工姓名"].dropna().unique().tolist() if str(x).strip()]
-    )
+    staff_all = distinct_names(df_all["员工姓名"])
     if row["员工姓名"] not in staff_all:
         staff_all.append(row["员工姓名"])
     edit_staff = st.selectbox(
@@ -501,19 +593,29 @@ def page_summary():
         if len(idx) == 0:
             st.error("未找到该 ID 的记录（可能刚刚被删除），请刷新页面。")
             return
-        idx = idx[0]
 
-        df_all.at[idx, "日期"] = edit_date.strftime("%Y-%m-%d")
-        df_all.at[idx, "员工姓名"] = edit_staff
-        df_all.at[idx, "客人姓名"] = edit_client
-        df_all.at[idx, "服务时长(分钟)"] = edit_duration
-        df_all.at[idx, "工时(小时)"] = edit_hours
-        df_all.at[idx, "服务收入"] = edit_income
-        df_all.at[idx, "小费"] = edit_tip
-        df_all.at[idx, "总收入"] = round(edit_income + edit_tip, 2)
+        # 行顺序与表格一致：表内行号 = 数据行位置 + 2（1 行表头，行号从 1 起）
+        row_idx = int(idx[0]) + 2
+        new_row = [
+            int(edit_id),
+            edit_date.strftime("%Y-%m-%d"),
+            edit_staff,
+            edit_client,
+            str(row["服务项目"]),
+            int(edit_duration),
+            edit_hours,
+            edit_income,
+            edit_tip,
+            round(edit_income + edit_tip, 2),
+        ]
 
         ensure_staff_exists(edit_staff)
-        save_all(df_all)
+        # 只更新这一行的 10 个单元格，不整表重写
+        ws = get_or_create_worksheet(SHEET_RECORD)
+        ws.update(
+            [new_row], f"A{row_idx}:J{row_idx}", value_input_option="USER_ENTERED"
+        )
+        load_records.clear()
 
         st.success(f"已更新 ID {edit_id} 的记录。请重新选择筛选条件查看最新数据。")
 
@@ -539,12 +641,10 @@ def page_delete_records():
     st.markdown("---")
     st.subheader("按条件删除部分记录")
 
-    all_staff = sorted(
-        [x for x in df["员工姓名"].dropna().unique().tolist() if str(x).strip()]
-    )
+    all_staff = distinct_names(df["员工姓名"])
     staff_filter = st.multiselect("先筛选员工（可多选）", all_staff, default=all_staff)
 
-    date_series = pd.to_datetime(df["日期"], errors="coerce")
+    date_series = df["_date"]
     if date_series.isna().all():
         st.error("所有日期都无效，请检查表格中的“日期”格式。")
         return
@@ -552,23 +652,20 @@ def page_delete_records():
     min_date, max_date = date_series.min().date(), date_series.max().date()
     date_range = st.date_input("日期范围", value=(min_date, max_date))
 
-    df_filtered = df.copy()
+    mask = pd.Series(True, index=df.index)
     if staff_filter:
-        df_filtered = df_filtered[df_filtered["员工姓名"].isin(staff_filter)]
-
+        mask &= df["员工姓名"].isin(staff_filter)
     if isinstance(date_range, tuple) and len(date_range) == 2:
         start_d, end_d = date_range
-        df_filtered = df_filtered[
-            (pd.to_datetime(df_filtered["日期"]) >= pd.to_datetime(start_d))
-            & (pd.to_datetime(df_filtered["日期"]) <= pd.to_datetime(end_d))
-        ]
+        mask &= date_series.between(pd.Timestamp(start_d), pd.Timestamp(end_d))
+    df_filtered = df[mask]
 
     if df_filtered.empty:
         st.warning("当前条件下没有可删除记录。")
         return
 
     st.subheader("当前筛选的记录（含 ID）")
-    st.dataframe(df_filtered, use_container_width=True)
+    st.dataframe(df_filtered[COLUMNS], use_container_width=True)
 
     id_options = df_filtered["ID"].tolist()
     selected_ids = st.multiselect("选择要删除的记录（按 ID）", id_options)